@@ -9,40 +9,128 @@ This module orchestrates the diagnostic pipeline:
 The handler is intentionally lightweight so it can run comfortably inside the
 Lambda execution environment.  Most heavy lifting is delegated to helper
 functions that can be unit tested in isolation.
+
+When ``DIAGNOSTIC_WORKER_FUNCTION`` or ``DIAGNOSTIC_QUEUE_URL`` is set, step 3
+is handed off: the front-end handler prepares the prompt, passes it to
+``worker_handler`` (deployed as a separate Lambda from the same package) by
+asynchronous invocation or through SQS, and answers ``202`` with a
+``request_id`` that clients poll until the worker has stored the result in the
+response cache.
 """
 from __future__ import annotations
 
 import base64
+import binascii
+import hashlib
 import json
 import logging
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
+import boto3
+import boto3.exceptions
 import botocore.exceptions
 import openai
 from dotenv import load_dotenv
 
-from utils.s3_helper import S3Object, upload_media_from_base64
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None  # type: ignore[assignment]
+
+from utils.cache_helper import cache_enabled, get_cached_response, store_response
+from utils.image_helper import downscale_image
+from utils.s3_helper import (
+    S3Object,
+    digest_base64_payload,
+    guess_content_type,
+    upload_media,
+    upload_media_from_base64,
+    validate_base64_payload,
+)
 
 LOGGER = logging.getLogger(__name__)
-LOGGER.setLevel(logging.INFO)
 
 load_dotenv()
 
+# Production runs at WARNING so per-request INFO records are never formatted.
+# An unknown LOG_LEVEL falls back to WARNING rather than failing the import.
+_LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+LOGGER.setLevel(logging.getLevelNamesMapping().get(_LOG_LEVEL, logging.WARNING))
+
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Requests without media do not need a vision-capable model.
+OPENAI_TEXT_MODEL = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o-mini")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "800"))
+OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
 S3_BUCKET = os.getenv("S3_BUCKET")
+DIAGNOSTIC_WORKER_FUNCTION = os.getenv("DIAGNOSTIC_WORKER_FUNCTION")
+DIAGNOSTIC_QUEUE_URL = os.getenv("DIAGNOSTIC_QUEUE_URL")
+_USE_WORKER = bool(DIAGNOSTIC_WORKER_FUNCTION or DIAGNOSTIC_QUEUE_URL)
+
+# OpenAI accepts inline images up to this size; larger media goes through S3.
+# This equals the default MAX_MEDIA_BYTES, so the presigned-URL fallback for
+# images only applies when MAX_MEDIA_BYTES is raised above it.
+MAX_INLINE_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Shared by every prompt; treat as read-only since it is reused by reference.
+_SYSTEM_MESSAGE: Dict[str, Any] = {
+    "role": "system",
+    "content": (
+        "You are an experienced automotive mechanic. Analyse the user's "
+        "description and the provided media to produce a concise diagnostic "
+        "report. Reply with a JSON object with the keys \"summary\" (a string) "
+        "and \"potential_causes\", \"safety_checks\" and "
+        "\"recommended_actions\" (each a list of strings)."
+    ),
+}
+_USER_DESCRIPTION_PREFIX = "User description: "
+
+# Shared worker pool for I/O that can overlap with the rest of the pipeline.
+# Sized to SQS's default batch of ten so a worker batch runs fully in parallel.
+_EXECUTOR = ThreadPoolExecutor(max_workers=10)
+
+_LAMBDA_CLIENT: Optional[Any] = None
+_SQS_CLIENT: Optional[Any] = None
+_OPENAI_CLIENT: Optional[openai.OpenAI] = None
+# Sends (messages, model) to OpenAI and returns the reply text.
+_Caller = Callable[[list[Dict[str, Any]], str], str]
+_CALL_FN: Optional[_Caller] = None
 
 
 def _init_openai_client() -> openai.OpenAI:
-    """Initialise and cache the OpenAI client."""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY environment variable is not set")
-    return openai.OpenAI(api_key=api_key)
+    """Initialise and cache the OpenAI client.
+
+    The client owns the HTTP connection pool, so reusing it across warm
+    invocations avoids a fresh TLS handshake for every request.
+    """
+    global _OPENAI_CLIENT
+
+    if _OPENAI_CLIENT is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY environment variable is not set")
+        _OPENAI_CLIENT = openai.OpenAI(api_key=api_key)
+    return _OPENAI_CLIENT
+
+
+def _json_loads(data: str | bytes) -> Any:
+    """Parse JSON with orjson when available, otherwise the stdlib parser."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(value: Any) -> str:
+    """Serialise JSON with orjson when available, otherwise the stdlib encoder."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value)
 
 
-@dataclass
+@dataclass(slots=True)
 class DiagnosticRequest:
     """Represents the body of the incoming API Gateway event."""
 
@@ -52,13 +140,20 @@ class DiagnosticRequest:
 
     @classmethod
     def from_event(cls, event: Dict[str, Any]) -> "DiagnosticRequest":
-        try:
-            body = event.get("body") or "{}"
-            if event.get("isBase64Encoded"):
-                body = base64.b64decode(body).decode("utf-8")
-            payload = json.loads(body)
-        except (ValueError, json.JSONDecodeError) as exc:
-            raise ValueError("Request body is not valid JSON") from exc
+        body = event.get("body") or "{}"
+        # Direct SDK invocations and some integrations deliver a parsed body.
+        if isinstance(body, dict):
+            payload = body
+        else:
+            try:
+                if event.get("isBase64Encoded"):
+                    # Both JSON parsers accept UTF-8 bytes directly.
+                    body = base64.b64decode(body)
+                payload = _json_loads(body)
+            except (ValueError, json.JSONDecodeError) as exc:
+                raise ValueError("Request body is not valid JSON") from exc
+            if not isinstance(payload, dict):
+                raise ValueError("Request body must be a JSON object")
 
         description = payload.get("description", "").strip()
         if not description:
@@ -71,7 +166,7 @@ class DiagnosticRequest:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class DiagnosticResponse:
     """Structured response returned to API Gateway."""
 
@@ -89,31 +184,83 @@ class DiagnosticResponse:
         }
 
 
-def _build_messages(request: DiagnosticRequest, media_object: Optional[S3Object]) -> list[Dict[str, Any]]:
-    """Construct the multimodal chat messages for GPT-4o."""
+def _start_media_upload(
+    request: DiagnosticRequest,
+) -> tuple[Optional[str], str, Future[S3Object]]:
+    """Start archiving the request's media and pick the URL handed to the model.
+
+    Images are downscaled first so both the model and S3 receive the smaller
+    JPEG, and are returned as a ``data:`` URL when they fit inline.  Other
+    media (or oversized images) yield ``None``; the caller must then wait for
+    the upload and use its presigned URL.  The SHA-256 digest of the original
+    media is returned alongside for response caching.
+    """
+    filename = request.media_filename or ""
+    payload = request.media_base64 or ""
+    content_type = guess_content_type(filename)
+
+    if not content_type.startswith("image/"):
+        digest = digest_base64_payload(payload)
+        return None, digest, _EXECUTOR.submit(
+            upload_media_from_base64,
+            bucket=S3_BUCKET,
+            base64_payload=payload,
+            filename=filename,
+            digest=digest,
+        )
+
+    try:
+        image = base64.b64decode(payload, validate=True)
+    except (ValueError, binascii.Error) as exc:
+        raise ValueError("Invalid base64 payload provided") from exc
+    digest = hashlib.sha256(image).hexdigest()
+
+    resized = downscale_image(image)
+    if resized is not None:
+        image = resized
+        filename = f"{os.path.splitext(filename)[0]}.jpg"
+        content_type = "image/jpeg"
+        payload = base64.b64encode(image).decode("ascii")
+
+    upload_future = _EXECUTOR.submit(
+        upload_media,
+        bucket=S3_BUCKET,
+        data=image,
+        filename=filename,
+        content_type=content_type,
+    )
+    if len(image) > MAX_INLINE_IMAGE_BYTES:
+        return None, digest, upload_future
+    return f"data:{content_type};base64,{payload}", digest, upload_future
+
+
+def _request_fingerprint(description: str, media_digest: Optional[str]) -> str:
+    """Identify a diagnostic question by its description and media content."""
+    return hashlib.sha256(f"{media_digest or ''}\n{description}".encode("utf-8")).hexdigest()
+
+
+def _build_messages(request: DiagnosticRequest, media_url: Optional[str]) -> list[Dict[str, Any]]:
+    """Construct the multimodal chat messages for GPT-4o.
+
+    Messages use the Chat Completions content-part shapes; the Responses API
+    caller converts them with ``_to_responses_input``.
+    """
     user_content: list[Dict[str, Any]] = [
-        {"type": "text", "text": f"User description: {request.description}"},
+        {"type": "text", "text": _USER_DESCRIPTION_PREFIX + request.description},
     ]
 
-    if media_object:
+    if media_url:
         user_content.append(
             {
-                "type": "input_image",
+                "type": "image_url",
                 "image_url": {
-                    "url": media_object.presigned_url,
+                    "url": media_url,
                 },
             }
         )
 
     return [
-        {
-            "role": "system",
-            "content": (
-                "You are an experienced automotive mechanic. Analyse the user's "
-                "description and the provided media to produce a concise diagnostic "
-                "report."
-            ),
-        },
+        _SYSTEM_MESSAGE,
         {
             "role": "user",
             "content": user_content,
@@ -121,93 +268,292 @@ def _build_messages(request: DiagnosticRequest, media_object: Optional[S3Object]
     ]
 
 
-def _invoke_openai(messages: list[Dict[str, Any]]) -> DiagnosticResponse:
-    client = _init_openai_client()
-
-    text: str = ""
-
+def _to_responses_input(messages: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    """Convert Chat Completions messages to Responses API input items."""
+    converted: list[Dict[str, Any]] = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            content = [
+                {"type": "input_text", "text": part["text"]}
+                if part["type"] == "text"
+                else {"type": "input_image", "image_url": part["image_url"]["url"]}
+                for part in content
+            ]
+        converted.append({"role": message["role"], "content": content})
+    return converted
+
+
+def _make_caller(client: openai.OpenAI) -> _Caller:
+    """Return a function that sends messages to OpenAI and returns the raw text.
+
+    Feature detection between the Responses and Chat Completions APIs happens
+    once here instead of on every request.  Replies are requested in JSON mode
+    so they parse on the first attempt.
+    """
     responses_api = getattr(client, "responses", None)
     if responses_api and hasattr(responses_api, "create"):
-        completion = responses_api.create(
-            model=OPENAI_MODEL,
-            input=messages,
-            max_output_tokens=800,
-        )
-        text = getattr(completion, "output_text", "") or ""
-    else:
-        chat_api = getattr(client, "chat", None)
-        if not chat_api or not hasattr(chat_api, "completions"):
-            raise RuntimeError("OpenAI client does not support responses or chat completions APIs")
-
-        completion = chat_api.completions.create(
-            model=OPENAI_MODEL,
+        responses_options = {
+            "max_output_tokens": OPENAI_MAX_TOKENS,
+            "temperature": OPENAI_TEMPERATURE,
+            "text": {"format": {"type": "json_object"}},
+        }
+
+        def call_responses(messages: list[Dict[str, Any]], model: str) -> str:
+            completion = responses_api.create(
+                model=model,
+                input=_to_responses_input(messages),
+                **responses_options,
+            )
+            return getattr(completion, "output_text", "") or ""
+
+        return call_responses
+
+    chat_api = getattr(client, "chat", None)
+    if not chat_api or not hasattr(chat_api, "completions"):
+        raise RuntimeError("OpenAI client does not support responses or chat completions APIs")
+
+    completions_api = chat_api.completions
+    chat_options = {
+        "max_tokens": OPENAI_MAX_TOKENS,
+        "temperature": OPENAI_TEMPERATURE,
+        "response_format": {"type": "json_object"},
+    }
+
+    def call_chat(messages: list[Dict[str, Any]], model: str) -> str:
+        completion = completions_api.create(
+            model=model,
             messages=messages,
-            max_tokens=800,
+            **chat_options,
         )
 
-        if completion.choices:
-            message = completion.choices[0].message
-            content = getattr(message, "content", "")
-            if isinstance(content, list):
-                text = "".join(part.get("text", "") for part in content if isinstance(part, dict))
-            else:
-                text = content or ""
+        if not completion.choices:
+            return ""
+        content = completion.choices[0].message.content
+        if isinstance(content, str):
+            return content
+        if not content:
+            return ""
+        return "".join([part["text"] for part in content if part.get("type") == "text"])
+
+    return call_chat
+
+
+def _get_openai_caller() -> _Caller:
+    """Return the cached OpenAI call function, building it on first use."""
+    global _CALL_FN
+
+    if _CALL_FN is None:
+        _CALL_FN = _make_caller(_init_openai_client())
+    return _CALL_FN
+
+
+if os.getenv("OPENAI_API_KEY"):
+    # Pay for client construction and API detection during the Lambda init phase.
+    _get_openai_caller()
+
 
-    text = text.strip()
+def _string_list(value: Any) -> list[str]:
+    """Coerce a report field to a list of strings; anything else becomes empty."""
+    if not isinstance(value, list):
+        return []
+    return [item if isinstance(item, str) else str(item) for item in value]
+
+
+def _invoke_openai(messages: list[Dict[str, Any]], model: str = OPENAI_MODEL) -> DiagnosticResponse:
+    text = _get_openai_caller()(messages, model).strip()
     if not text:
         raise RuntimeError("OpenAI returned an empty response")
 
-    # Basic parsing: expect a JSON document; fallback to plain text summary.
-    try:
-        parsed = json.loads(text)
-        return DiagnosticResponse(
-            summary=parsed.get("summary", text),
-            potential_causes=list(parsed.get("potential_causes", [])),
-            safety_checks=list(parsed.get("safety_checks", [])),
-            recommended_actions=list(parsed.get("recommended_actions", [])),
-        )
-    except json.JSONDecodeError:
-        return DiagnosticResponse(
-            summary=text,
-            potential_causes=[],
-            safety_checks=[],
-            recommended_actions=[],
+    # Basic parsing: expect a JSON object; fallback to plain text summary.
+    # Plain-text answers never start with a brace, so they skip the parser
+    # (and the exception it would raise) entirely.
+    if text.startswith("{"):
+        try:
+            parsed = _json_loads(text)
+        except json.JSONDecodeError:
+            pass
+        else:
+            summary = parsed.get("summary")
+            return DiagnosticResponse(
+                summary=summary if isinstance(summary, str) else text,
+                potential_causes=_string_list(parsed.get("potential_causes")),
+                safety_checks=_string_list(parsed.get("safety_checks")),
+                recommended_actions=_string_list(parsed.get("recommended_actions")),
+            )
+
+    return DiagnosticResponse(
+        summary=text,
+        potential_causes=[],
+        safety_checks=[],
+        recommended_actions=[],
+    )
+
+
+def _dispatch_to_worker(request_id: str, messages: list[Dict[str, Any]], model: str) -> None:
+    """Queue the model call for the worker Lambda without waiting for it."""
+    global _LAMBDA_CLIENT, _SQS_CLIENT
+
+    if not cache_enabled():
+        raise RuntimeError(
+            "DIAGNOSTIC_CACHE_TABLE must be set when a diagnostic worker is configured"
         )
 
+    payload = _json_dumps({"request_id": request_id, "messages": messages, "model": model})
+    if DIAGNOSTIC_QUEUE_URL:
+        if _SQS_CLIENT is None:
+            _SQS_CLIENT = boto3.client("sqs")
+        _SQS_CLIENT.send_message(QueueUrl=DIAGNOSTIC_QUEUE_URL, MessageBody=payload)
+        return
+
+    if _LAMBDA_CLIENT is None:
+        _LAMBDA_CLIENT = boto3.client("lambda")
+    _LAMBDA_CLIENT.invoke(
+        FunctionName=DIAGNOSTIC_WORKER_FUNCTION,
+        InvocationType="Event",
+        Payload=payload,
+    )
+
+
+def _pending_response(request_id: str) -> Dict[str, Any]:
+    return {
+        "statusCode": 202,
+        "headers": {"Content-Type": "application/json"},
+        "body": _json_dumps({"request_id": request_id, "status": "pending"}),
+    }
+
+
+def _run_worker_job(job: Dict[str, Any]) -> None:
+    response = _invoke_openai(job["messages"], job.get("model", OPENAI_MODEL))
+    store_response(job["request_id"], _json_dumps(response.as_dict()))
+
+
+def _run_sqs_record(record: Dict[str, Any]) -> None:
+    _run_worker_job(_json_loads(record["body"]))
+
+
+def worker_handler(event: Dict[str, Any], _context: Optional[Any]) -> Optional[Dict[str, Any]]:
+    """Entry point for the model worker Lambda.
+
+    Runs the OpenAI call for prompts prepared by ``lambda_handler`` and stores
+    each result where the polling client will find it.  A direct asynchronous
+    invocation carries one job and raises on failure so Lambda's retry policy
+    applies.  An SQS batch is processed concurrently on the shared thread pool
+    with the one warm OpenAI client, and failed records are returned as a
+    partial batch response so only they are redelivered.
+    """
+    records = event.get("Records")
+    if records is None:
+        _run_worker_job(event)
+        return None
+
+    _get_openai_caller()
+    futures = {
+        record["messageId"]: _EXECUTOR.submit(_run_sqs_record, record) for record in records
+    }
+
+    failures: list[Dict[str, str]] = []
+    for message_id, future in futures.items():
+        try:
+            future.result()
+        except Exception:  # noqa: BLE001 - one bad record must not fail the batch
+            LOGGER.exception("Failed to process diagnostic job %s", message_id)
+            failures.append({"itemIdentifier": message_id})
+    return {"batchItemFailures": failures}
+
 
 def lambda_handler(event: Dict[str, Any], _context: Optional[Any]) -> Dict[str, Any]:
     """Entry point for AWS Lambda."""
-    LOGGER.info("Received event: %s", event.keys())
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info("Received event keys: %s", list(event))
 
     try:
+        request_id = (event.get("queryStringParameters") or {}).get("request_id")
+        if request_id:
+            body = get_cached_response(request_id)
+            if body is None:
+                return _pending_response(request_id)
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": body,
+            }
+
         request = DiagnosticRequest.from_event(event)
-        media_object: Optional[S3Object] = None
+        media_url: Optional[str] = None
+        media_digest: Optional[str] = None
+        upload_future: Optional[Future[S3Object]] = None
 
         if request.media_base64 and request.media_filename:
             if not S3_BUCKET:
                 raise RuntimeError("S3_BUCKET environment variable is not set")
 
-            media_object = upload_media_from_base64(
-                bucket=S3_BUCKET,
-                base64_payload=request.media_base64,
-                filename=request.media_filename,
-            )
-
-        messages = _build_messages(request, media_object)
-        response = _invoke_openai(messages)
+            validate_base64_payload(request.media_base64)
+            media_url, media_digest, upload_future = _start_media_upload(request)
+
+        fingerprint = _request_fingerprint(request.description, media_digest)
+        body = get_cached_response(fingerprint)
+
+        if body is None:
+            # Async invocations and SQS messages are capped at 256 KB, so the worker
+            # always receives presigned URLs rather than inline images.
+            if upload_future is not None and (media_url is None or _USE_WORKER):
+                # The model fetches the media from S3, so the upload has to
+                # finish first; get the OpenAI client ready in the meantime.
+                if not _USE_WORKER:
+                    _get_openai_caller()
+                media_url = upload_future.result().presigned_url
+                upload_future = None
+
+            messages = _build_messages(request, media_url)
+            model = OPENAI_MODEL if media_url else OPENAI_TEXT_MODEL
+            if _USE_WORKER:
+                _dispatch_to_worker(fingerprint, messages, model)
+                return _pending_response(fingerprint)
+
+            response = _invoke_openai(messages, model)
+            body = _json_dumps(response.as_dict())
+            store_response(fingerprint, body)
+
+        if upload_future is not None:
+            # Lambda freezes background threads once the handler returns, so
+            # wait for the archival upload here, after the model has answered.
+            try:
+                upload_future.result()
+            except (
+                ValueError,
+                boto3.exceptions.S3UploadFailedError,
+                botocore.exceptions.BotoCoreError,
+                botocore.exceptions.ClientError,
+            ):
+                LOGGER.exception("Failed to archive media to S3")
 
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(response.as_dict()),
+            "body": body,
         }
 
-    except (ValueError, RuntimeError, botocore.exceptions.BotoCoreError) as exc:
+    except (
+        ValueError,
+        RuntimeError,
+        boto3.exceptions.S3UploadFailedError,
+        botocore.exceptions.BotoCoreError,
+        botocore.exceptions.ClientError,
+    ) as exc:
         LOGGER.exception("Error processing diagnostic request")
         return {
             "statusCode": 400,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"error": str(exc)}),
+            "body": _json_dumps({"error": str(exc)}),
+        }
+
+    except openai.OpenAIError:
+        LOGGER.exception("OpenAI request failed")
+        return {
+            "statusCode": 502,
+            "headers": {"Content-Type": "application/json"},
+            "body": _json_dumps({"error": "The diagnostic service is unavailable. Please try again."}),
         }
 
 
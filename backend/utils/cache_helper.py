@@ -0,0 +1,81 @@
+"""Utility helpers for caching diagnostic responses in DynamoDB."""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import Any, Optional
+
+try:
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:  # pragma: no cover - caching is skipped at runtime
+    boto3 = None  # type: ignore[assignment]
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL_SECONDS = 86400
+
+_DYNAMODB_CLIENT: Optional[Any] = None
+
+
+def _cache_table() -> Optional[str]:
+    # Read lazily so values loaded from .env after import are honoured.
+    return os.getenv("DIAGNOSTIC_CACHE_TABLE")
+
+
+def cache_enabled() -> bool:
+    """Return whether a DynamoDB table is configured for responses."""
+    return boto3 is not None and bool(_cache_table())
+
+
+def _get_dynamodb_client():
+    """Return the shared DynamoDB client, or ``None`` when caching is disabled."""
+    global _DYNAMODB_CLIENT
+
+    if not cache_enabled():
+        return None
+    if _DYNAMODB_CLIENT is None:
+        _DYNAMODB_CLIENT = boto3.client("dynamodb")
+    return _DYNAMODB_CLIENT
+
+
+def get_cached_response(fingerprint: str) -> Optional[str]:
+    """Return the cached response body for ``fingerprint`` if one is stored."""
+    client = _get_dynamodb_client()
+    if client is None:
+        return None
+
+    try:
+        item = client.get_item(
+            TableName=_cache_table(),
+            Key={"fingerprint": {"S": fingerprint}},
+        ).get("Item")
+    except (BotoCoreError, ClientError):
+        LOGGER.warning("Failed to read diagnostic cache", exc_info=True)
+        return None
+
+    # DynamoDB deletes expired items lazily, so check the TTL ourselves too.
+    if not item or int(item["expires_at"]["N"]) < time.time():
+        return None
+    return item["response"]["S"]
+
+
+def store_response(fingerprint: str, body: str) -> None:
+    """Cache a response body under ``fingerprint``; failures are only logged."""
+    client = _get_dynamodb_client()
+    if client is None:
+        return
+
+    ttl = int(os.getenv("DIAGNOSTIC_CACHE_TTL", DEFAULT_CACHE_TTL_SECONDS))
+    try:
+        client.put_item(
+            TableName=_cache_table(),
+            Item={
+                "fingerprint": {"S": fingerprint},
+                "response": {"S": body},
+                "expires_at": {"N": str(int(time.time()) + ttl)},
+            },
+        )
+    except (BotoCoreError, ClientError):
+        LOGGER.warning("Failed to write diagnostic cache", exc_info=True)
@@ -0,0 +1,76 @@
+"""Utility helpers for shrinking uploaded photos before analysis."""
+from __future__ import annotations
+
+import io
+import os
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - resizing is skipped at runtime
+    Image = None  # type: ignore[assignment]
+    ImageOps = None  # type: ignore[assignment]
+
+try:
+    import pyvips
+except (ImportError, OSError):  # pragma: no cover - needs libvips on the host
+    pyvips = None  # type: ignore[assignment]
+
+DEFAULT_MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 85
+
+
+def _downscale_with_vips(data: bytes, max_side: int) -> Optional[bytes]:
+    try:
+        # thumbnail_buffer shrinks while decoding and applies EXIF rotation.
+        image = pyvips.Image.thumbnail_buffer(data, max_side, height=max_side, size="down")
+        return image.write_to_buffer(
+            ".jpg", Q=JPEG_QUALITY, optimize_coding=True, strip=True
+        )
+    except pyvips.Error:
+        return None
+
+
+def _downscale_with_pillow(data: bytes, max_side: int) -> Optional[bytes]:
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Let the JPEG decoder scale down by DCT while loading; a no-op
+            # for other formats.
+            image.draft("RGB", (max_side, max_side))
+            # Re-encoding drops EXIF, so bake the orientation into the pixels.
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Pillow raises ValueError for some valid images it cannot resample
+        # (e.g. 16-bit grayscale); the caller then keeps the original bytes.
+        return None
+    return output.getvalue()
+
+
+def downscale_image(data: bytes, max_side: Optional[int] = None) -> Optional[bytes]:
+    """Return ``data`` as a JPEG whose longest side is at most ``max_side``.
+
+    ``max_side`` defaults to the ``MAX_IMAGE_SIDE`` environment variable.
+    libvips is used when ``pyvips`` is importable, otherwise Pillow.
+
+    Returns ``None`` when neither library is available, the image cannot be
+    decoded, or re-encoding would not make the payload smaller; callers then
+    keep the original bytes.
+    """
+    if max_side is None:
+        max_side = int(os.getenv("MAX_IMAGE_SIDE", DEFAULT_MAX_IMAGE_SIDE))
+
+    if pyvips is not None:
+        resized = _downscale_with_vips(data, max_side)
+    elif Image is not None:
+        resized = _downscale_with_pillow(data, max_side)
+    else:
+        return None
+
+    if resized is None or len(resized) >= len(data):
+        return None
+    return resized
@@ -3,25 +3,99 @@ from __future__ import annotations
 
 import base64
 import binascii
+import functools
+import hashlib
+import io
 import mimetypes
 import os
+import re
 import time
 from dataclasses import dataclass
+from typing import Any, Optional
+from urllib.parse import quote
 
 try:
     import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.auth import S3SigV4QueryAuth
+    from botocore.awsrequest import AWSRequest
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
 except ImportError:  # pragma: no cover - handled at runtime
     boto3 = None  # type: ignore[assignment]
+    Config = None  # type: ignore[assignment]
+    TransferConfig = None  # type: ignore[assignment]
+
+MIB = 1024 * 1024
+MULTIPART_THRESHOLD = 8 * MIB
+MULTIPART_CHUNK_SIZE = 8 * MIB
+MULTIPART_MAX_WORKERS = 8
+# Slices must be a multiple of four characters so each decodes on its own.
+DECODE_CHUNK_CHARS = 4 * 64 * 1024
+
+DEFAULT_MAX_MEDIA_BYTES = 20 * MIB
+# Only a prefix is scanned up front; the decoder validates the rest as it goes.
+BASE64_PREFIX_CHECK_CHARS = 256
+_BASE64_PREFIX_RE = re.compile(r"[A-Za-z0-9+/=]*")
+
+PRESIGNED_URL_EXPIRES = 3600
+# Cached URLs are reissued every half expiry window, so a returned URL always
+# has at least that long left to live.
+_PRESIGN_REFRESH_SECONDS = PRESIGNED_URL_EXPIRES // 2
+
+_S3_CONFIG = (
+    Config(
+        max_pool_connections=50,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+        tcp_keepalive=True,
+        connect_timeout=2,
+        read_timeout=10,
+        s3={"use_accelerate_endpoint": False, "addressing_style": "virtual"},
+    )
+    if Config is not None
+    else None
+)
+_TRANSFER_CONFIG = (
+    TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNK_SIZE,
+        max_concurrency=MULTIPART_MAX_WORKERS,
+    )
+    if TransferConfig is not None
+    else None
+)
+
+
+_SESSION: Optional[Any] = None
+_S3_CLIENT: Optional[Any] = None
 
 
 def _get_s3_client():
-    """Return an S3 client, ensuring boto3 is available."""
+    """Return the shared S3 client, ensuring boto3 is available.
+
+    Building a client loads botocore's service data and endpoint rules, which
+    is far more expensive than the calls we make with it, so a single client is
+    created per execution environment and reused across warm invocations.
+    """
+    global _SESSION, _S3_CLIENT
 
     if boto3 is None:
         raise RuntimeError(
             "boto3 is required to upload media. Install it with 'pip3 install boto3'."
         )
-    return boto3.client("s3")
+    if _S3_CLIENT is None:
+        _SESSION = boto3.session.Session()
+        # Lambda always sets AWS_REGION; pinning it skips region discovery.
+        _S3_CLIENT = _SESSION.client(
+            "s3", region_name=os.getenv("AWS_REGION"), config=_S3_CONFIG
+        )
+    return _S3_CLIENT
+
+
+if boto3 is not None:
+    # Create the client during Lambda's init phase rather than on the first
+    # request that carries media.
+    _get_s3_client()
 
 
 @dataclass
@@ -31,29 +105,177 @@ class S3Object:
     bucket: str
     key: str
     presigned_url: str
+    digest: str
 
 
-def _guess_content_type(filename: str) -> str:
-    content_type, _ = mimetypes.guess_type(filename)
-    return content_type or "application/octet-stream"
+# Parse the system MIME tables during import instead of on the first upload.
+mimetypes.init()
 
+# Extensions phones and browsers typically produce, resolved without a
+# registry lookup.
+_EXT_TO_CONTENT_TYPE = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".heic": "image/heic",
+    ".webp": "image/webp",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".webm": "video/webm",
+}
 
-def upload_media_from_base64(bucket: str, base64_payload: str, filename: str) -> S3Object:
-    """Upload a base64 encoded media payload to S3."""
+
+def guess_content_type(filename: str) -> str:
+    content_type = _EXT_TO_CONTENT_TYPE.get(os.path.splitext(filename)[1].lower())
+    return content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def validate_base64_payload(base64_payload: str) -> None:
+    """Reject oversized or obviously malformed base64 before decoding it.
+
+    The limit comes from the ``MAX_MEDIA_BYTES`` environment variable.
+    """
+    max_bytes = int(os.getenv("MAX_MEDIA_BYTES", DEFAULT_MAX_MEDIA_BYTES))
+    if len(base64_payload) * 3 // 4 > max_bytes:
+        raise ValueError(f"Media exceeds the maximum size of {max_bytes} bytes")
+    if len(base64_payload) % 4 or not _BASE64_PREFIX_RE.fullmatch(
+        base64_payload, 0, BASE64_PREFIX_CHECK_CHARS
+    ):
+        raise ValueError("Invalid base64 payload provided")
+
+
+class _Base64Reader(io.RawIOBase):
+    """Read-only stream that decodes a base64 string slice by slice.
+
+    Only one slice of decoded bytes is alive at a time, so the upload never
+    holds a second full-size copy of the media next to the encoded payload.
+    """
+
+    def __init__(self, payload: str) -> None:
+        self._payload = payload
+        self._offset = 0
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and self._offset < len(self._payload):
+            chunk = self._payload[self._offset : self._offset + DECODE_CHUNK_CHARS]
+            self._offset += len(chunk)
+            try:
+                self._pending = memoryview(base64.b64decode(chunk, validate=True))
+            except (ValueError, binascii.Error) as exc:
+                raise ValueError("Invalid base64 payload provided") from exc
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+@functools.lru_cache(maxsize=256)
+def _presign_get_object(bucket: str, key: str, _window: int) -> str:
+    """Sign a GET URL for ``key`` without going through generate_presigned_url.
+
+    ``_window`` only takes part in the cache key so entries roll over before
+    the URLs they hold expire.
+    """
     s3 = _get_s3_client()
+    credentials = _SESSION.get_credentials()
+    if credentials is None:
+        raise RuntimeError("AWS credentials are not configured")
+
+    region = s3.meta.region_name or "us-east-1"
+    request = AWSRequest(
+        method="GET",
+        url=f"https://{bucket}.s3.{region}.amazonaws.com/{quote(key, safe='/~')}",
+    )
+    S3SigV4QueryAuth(
+        credentials.get_frozen_credentials(), "s3", region, expires=PRESIGNED_URL_EXPIRES
+    ).add_auth(request)
+    return request.url
+
+
+def presign_get_object(bucket: str, key: str) -> str:
+    """Return a presigned GET URL for an object, reusing recent signatures."""
+    return _presign_get_object(bucket, key, int(time.time()) // _PRESIGN_REFRESH_SECONDS)
+
+
+def digest_base64_payload(base64_payload: str) -> str:
+    """Return the SHA-256 hex digest of the decoded payload without buffering it."""
+    reader = _Base64Reader(base64_payload)
+    digest = hashlib.sha256()
+    while chunk := reader.read(DECODE_CHUNK_CHARS):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _object_exists(s3, bucket: str, key: str) -> bool:
     try:
-        binary_data = base64.b64decode(base64_payload)
-    except (ValueError, binascii.Error) as exc:
-        raise ValueError("Invalid base64 payload provided") from exc
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as exc:
+        error_code = exc.response.get("Error", {}).get("Code")
+        # Without s3:ListBucket, S3 answers 403 for missing keys; uploading
+        # again is harmless, so treat it as absent.
+        if error_code in {"403", "404", "NoSuchKey", "NotFound", "AccessDenied"}:
+            return False
+        raise
+    return True
+
 
-    content_type = _guess_content_type(filename)
-    timestamp = int(time.time())
-    key = f"uploads/{timestamp}-{os.path.basename(filename)}"
+def _upload_fileobj(
+    bucket: str, fileobj: Any, filename: str, content_type: str, digest: str
+) -> S3Object:
+    s3 = _get_s3_client()
+    # Content-addressed keys let repeated uploads of the same media reuse the
+    # object that is already stored.
+    extension = os.path.splitext(filename)[1].lower()
+    key = f"uploads/{digest[:2]}/{digest}{extension}"
+
+    # Presigning is a local signing operation that does not need the object to
+    # exist yet, so the URL is ready as soon as the upload finishes.
+    presigned_url = presign_get_object(bucket, key)
 
-    s3.put_object(Bucket=bucket, Key=key, Body=binary_data, ContentType=content_type)
+    if not _object_exists(s3, bucket, key):
+        # The managed transfer switches to concurrent multipart uploads above
+        # the threshold and otherwise sends a single PutObject.
+        s3.upload_fileobj(
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_TRANSFER_CONFIG,
+        )
 
-    presigned_url = s3.generate_presigned_url(
-        "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=3600
+    return S3Object(bucket=bucket, key=key, presigned_url=presigned_url, digest=digest)
+
+
+def upload_media(
+    bucket: str,
+    data: bytes,
+    filename: str,
+    content_type: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> S3Object:
+    """Upload already decoded media bytes to S3."""
+    return _upload_fileobj(
+        bucket,
+        io.BytesIO(data),
+        filename,
+        content_type or guess_content_type(filename),
+        digest or hashlib.sha256(data).hexdigest(),
     )
 
-    return S3Object(bucket=bucket, key=key, presigned_url=presigned_url)
+
+def upload_media_from_base64(
+    bucket: str, base64_payload: str, filename: str, digest: Optional[str] = None
+) -> S3Object:
+    """Upload a base64 encoded media payload to S3."""
+    return _upload_fileobj(
+        bucket,
+        io.BufferedReader(_Base64Reader(base64_payload), buffer_size=DECODE_CHUNK_CHARS),
+        filename,
+        guess_content_type(filename),
+        digest or digest_base64_payload(base64_payload),
+    )
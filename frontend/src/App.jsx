@@ -24,6 +24,27 @@ const normaliseResult = (payload = {}) => ({
   recommended_actions: toStringList(payload.recommended_actions),
 });
 
+const POLL_INTERVAL_MS = 1500;
+const MAX_POLL_ATTEMPTS = 60;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// The backend answers 202 with a request_id when the model call runs on the
+// worker Lambda; poll until the diagnosis is ready.
+const waitForResult = async (response) => {
+  let { status, data } = response;
+  for (let attempt = 0; status === 202 && attempt < MAX_POLL_ATTEMPTS; attempt += 1) {
+    await sleep(POLL_INTERVAL_MS);
+    ({ status, data } = await axios.get(API_URL, {
+      params: { request_id: data.request_id },
+    }));
+  }
+  if (status === 202) {
+    throw new Error('The diagnosis is taking longer than expected. Please try again.');
+  }
+  return data;
+};
+
 const readFileAsBase64 = (file) =>
   new Promise((resolve, reject) => {
     const reader = new FileReader();
@@ -108,11 +129,11 @@ export default function App() {
         filename,
       };
 
-      const { data } = await axios.post(API_URL, payload, {
+      const response = await axios.post(API_URL, payload, {
         headers: { 'Content-Type': 'application/json' },
       });
 
-      setResult(normaliseResult(data));
+      setResult(normaliseResult(await waitForResult(response)));
     } catch (err) {
       console.error(err);
       setError(